@@ -1,91 +1,273 @@
-import yfinance as yf
+import asyncio
+import functools
+import io
 import requests
-import json
-import pandas as pd
-from datetime import datetime
+import requests_cache
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import orjson
+import re
+from lxml import etree
+import os
+from datetime import datetime, timezone
 
 # User Configuration
 FEISHU_WEBHOOK_URL = "https://open.feishu.cn/open-apis/bot/v2/hook/865c3b28-d2eb-4d5d-ab7e-582ad42414cd"
 
-def get_gold_prices():
+SYMBOLS_GOLD = {"GC=F": "Gold Futures (COMEX)", "GLD": "SPDR Gold Shares (ETF)"}
+SYMBOLS_SEMI = {
+    "000660.KS": {"name": "SK Hynix", "unit": "₩"},
+    "005930.KS": {"name": "Samsung Electronics", "unit": "₩"},
+    "285A.T":    {"name": "Kioxia", "unit": "¥"}
+}
+
+# On-disk HTTP cache: SunSirs only updates once per business day.
+# stale_if_error serves the last good response if the site is down.
+SESSION = requests_cache.CachedSession(
+    'price_cache.sqlite',
+    expire_after=3600,
+    allowable_codes=(200,),
+    stale_if_error=True
+)
+# Keep-alive pool shared by SunSirs and Feishu, with exponential backoff on
+# rate limits and transient server errors (0.5s, 1s, 2s, 4s).
+# yfinance uses its own curl_cffi session, so Yahoo requests are not covered.
+_retry = Retry(
+    total=4,
+    backoff_factor=0.5,
+    status_forcelist=[429, 500, 502, 503, 504],
+    allowed_methods=["GET"]
+)
+_adapter = HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=_retry)
+SESSION.mount("http://", _adapter)
+SESSION.mount("https://", _adapter)
+# The webhook POST is not idempotent: only retry when Feishu cannot have processed it
+# (connection failures, 429). Read/5xx errors may follow a delivered message.
+_webhook_retry = Retry(
+    total=4,
+    backoff_factor=0.5,
+    read=0,
+    other=0,
+    status_forcelist=[429],
+    allowed_methods=["POST"]
+)
+SESSION.mount("https://open.feishu.cn/", HTTPAdapter(max_retries=_webhook_retry))
+
+SUNSIRS_URL = "https://www.sunsirs.com/uk/prodetail-1432.html"
+# Product name is matched case-insensitively everywhere (lowercased name / gate / IGNORECASE)
+LIPF6_NAME = "lithium hexafluorophosphate"
+LIPF6_MARKER = LIPF6_NAME.encode()
+# Cell texts of a <tr> whose cells mention the product; evaluated per parsed row
+LIPF6_ROW_CELLS = etree.XPath(
+    "self::tr[td[contains(translate(., 'ABCDEFGHIJKLMNOPQRSTUVWXYZ', 'abcdefghijklmnopqrstuvwxyz'), $name)]]/td//text()"
+)
+# Price is the 3rd cell after the product name; matched against raw bytes to skip decoding the page
+LIPF6_RE = re.compile(
+    rb'Lithium hexafluorophosphate.*?</td>\s*<td>.*?</td>\s*<td>\s*([\d.]+)\s*</td>', re.DOTALL | re.IGNORECASE
+)
+
+# Last successful yfinance prices, used when Yahoo fails or rate-limits us
+LAST_KNOWN_PATH = os.path.expanduser("~/.price_cache.json")
+
+# Static Feishu report fragments
+HEADER_GOLD = "🏆 **Precious Metals**\n"
+HEADER_SEMI = "\n💾 **Memory & Storage**\n"
+HEADER_MATERIALS = "\n🔋 **Battery Materials**\n"
+FOOTER = "\n---"
+
+@functools.cache
+def _yf():
+    """
+    Imports yfinance (and pandas with it) on first use instead of at module load.
+    """
+    import yfinance
+    return yfinance
+
+def get_price_history(symbols):
     """
-    Fetches gold prices using yfinance.
+    Downloads recent daily history for all symbols in a single batched yfinance call.
+    Returns a DataFrame with one column group per ticker.
+    A 5-day window usually yields two closes across weekends/holidays (long exchange
+    holidays or halted tickers can still leave one); only Close is used,
+    so dividends/splits and pre/post-market data are not requested.
+    """
+    return _yf().download(
+        list(symbols),
+        period="5d",
+        interval="1d",
+        group_by="ticker",
+        actions=False,
+        auto_adjust=False,
+        prepost=False,
+        threads=True,
+        progress=False
+    )
+
+def _latest_closes(history, sym):
+    """
+    Returns the closing prices of a symbol with non-trading days removed.
+    Markets trade on different calendars, so the batched frame may contain NaN rows.
+    Returned as a plain list of floats so results stay JSON-serializable.
+    """
+    return history[sym]['Close'].dropna().tolist()
+
+def get_gold_prices(history):
+    """
+    Extracts gold prices from the batched yfinance history.
     """
     results = {}
-    symbols = {"GC=F": "Gold Futures (COMEX)", "GLD": "SPDR Gold Shares (ETF)"}
-    
-    for sym, name in symbols.items():
+
+    for sym, name in SYMBOLS_GOLD.items():
         try:
-            ticker = yf.Ticker(sym)
-            data = ticker.history(period="2d")
-            if len(data) >= 2:
-                current_price = data['Close'].iloc[-1]
-                prev_price = data['Close'].iloc[-2]
+            closes = _latest_closes(history, sym)
+            if len(closes) >= 2:
+                current_price = closes[-1]
+                prev_price = closes[-2]
                 change = current_price - prev_price
                 change_percent = (change / prev_price) * 100
                 results[name] = {
                     "price": current_price,
                     "change": change,
                     "change_percent": change_percent,
+                    "change_str": f"{change:+.2f}",
+                    "change_pct_str": f"{change_percent:+.2f}%",
                     "unit": "$"
                 }
-            elif len(data) == 1:
-                current_price = data['Close'].iloc[-1]
+            elif len(closes) == 1:
+                current_price = closes[-1]
                 results[name] = {
                     "price": current_price,
                     "change": 0,
                     "change_percent": 0,
+                    "change_str": "+0.00",
+                    "change_pct_str": "+0.00%",
                     "unit": "$"
                 }
-        except Exception as e:
-            print(f"Error fetching {sym}: {e}")
-            
+        except KeyError:
+            # Ticker missing from the batched frame (delisted / failed download)
+            print(f"Error fetching {sym}: no data returned")
+
     return results
 
-def get_semiconductor_prices():
+def get_semiconductor_prices(history):
     """
-    Fetches semiconductor stock prices (SK Hynix, Samsung, Kioxia).
+    Extracts semiconductor stock prices (SK Hynix, Samsung, Kioxia) from the batched yfinance history.
     """
     results = {}
-    symbols = {
-        "000660.KS": {"name": "SK Hynix", "unit": "₩"},
-        "005930.KS": {"name": "Samsung Electronics", "unit": "₩"},
-        "285A.T":    {"name": "Kioxia", "unit": "¥"}
-    }
-    
-    for sym, info in symbols.items():
+
+    for sym, info in SYMBOLS_SEMI.items():
         try:
-            ticker = yf.Ticker(sym)
-            data = ticker.history(period="2d")
-            
-            if len(data) >= 1:
-                current_price = data['Close'].iloc[-1]
-                if len(data) >= 2:
-                    prev_price = data['Close'].iloc[-2]
+            closes = _latest_closes(history, sym)
+
+            if len(closes) >= 1:
+                current_price = closes[-1]
+                if len(closes) >= 2:
+                    prev_price = closes[-2]
                     change = current_price - prev_price
                     change_percent = (change / prev_price) * 100
                 else:
                     change = 0
                     change_percent = 0
-                
+
+                # KRW/JPY usually don't use decimals for large numbers
                 results[info['name']] = {
                     "price": current_price,
                     "change": change,
                     "change_percent": change_percent,
+                    "change_str": f"{change:+.0f}",
+                    "change_pct_str": f"{change_percent:+.2f}%",
                     "unit": info['unit']
                 }
-        except Exception as e:
-            print(f"Error fetching {sym}: {e}")
-            results[info['name']] = {"error": str(e)}
-            
+        except KeyError:
+            # Ticker missing from the batched frame (delisted / failed download)
+            print(f"Error fetching {sym}: no data returned")
+            results[info['name']] = {"error": "No data returned"}
+
     return results
 
-def get_lipf6_price():
+def _load_last_known():
+    """
+    Loads the last-known prices file. Returns {} if it is missing or unreadable.
+    """
+    try:
+        with open(LAST_KNOWN_PATH, "rb") as f:
+            return orjson.loads(f.read())
+    except (OSError, orjson.JSONDecodeError):
+        return {}
+
+def _save_last_known(cache):
+    """
+    Writes the last-known prices file.
+    """
+    try:
+        with open(LAST_KNOWN_PATH, "wb") as f:
+            f.write(orjson.dumps(cache))
+    except OSError as e:
+        print(f"Warning: could not save last-known prices: {e}")
+
+def _with_last_known(cache, group, names, results):
+    """
+    Records fresh results in the last-known cache (with a UTC timestamp) and fills
+    missing or failed entries from it, tagged with `stale_hours`.
     """
-    Scrapes LiPF6 price from SunSirs (生意社) using Pandas.
+    now = datetime.now(timezone.utc)
+    saved = cache.setdefault(group, {})
+    merged = {}
+
+    for name in names:
+        info = results.get(name)
+        if info is not None and "error" not in info:
+            saved[name] = {**info, "fetched_at": now.isoformat()}
+            merged[name] = info
+        elif name in saved:
+            entry = dict(saved[name])
+            fetched_at = datetime.fromisoformat(entry.pop("fetched_at"))
+            entry["stale_hours"] = int((now - fetched_at).total_seconds() // 3600)
+            merged[name] = entry
+        elif info is not None:
+            merged[name] = info
+
+    return merged
+
+def _parse_lipf6_table(body):
+    """
+    Incrementally parses the page and stops at the first <tr> containing LiPF6.
+    Returns the first cell that looks like a price, or None.
+    """
+    for _, row in etree.iterparse(io.BytesIO(body), events=("end",), tag="tr", html=True):
+        # SunSirs table usually has columns like: [Product, Sector, Price, Date]
+        # One XPath call both matches the row and returns its cell texts (empty for other rows)
+        for text in LIPF6_ROW_CELLS(row, name=LIPF6_NAME):
+            # Look for a value that looks like a price (float > 1000)
+            try:
+                price_val = float(text.replace(',', '').strip())
+            except ValueError:
+                continue
+            if price_val > 1000: # Simple filter to distinguish from small numbers
+                return price_val
+
+        # Drop rows already scanned so the partial tree stays small
+        row.clear()
+        while row.getprevious() is not None:
+            del row.getparent()[0]
+
+    return None
+
+def _parse_lipf6_regex(body, start=0):
+    """
+    Fallback: pulls the price straight out of the raw HTML bytes (3rd cell after the product name).
+    Scanning starts at `start` so the lazy `.*?` never backtracks over the page header.
+    """
+    match = LIPF6_RE.search(body, start)
+    if match:
+        return float(match.group(1))
+    return None
+
+def get_lipf6_price(url=SUNSIRS_URL):
+    """
+    Scrapes LiPF6 price from SunSirs (生意社) with an incremental lxml parse, with a regex fallback.
     Target: https://www.sunsirs.com/uk/prodetail-1432.html
     """
-    url = "https://www.sunsirs.com/uk/prodetail-1432.html"
     try:
         headers = {
             "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
@@ -94,97 +276,132 @@ def get_lipf6_price():
         
         # 1. Fetch raw HTML
         # verify=False is important for GitHub Actions to avoid SSL errors with some CN sites
-        response = requests.get(url, headers=headers, timeout=30, verify=False)
+        response = SESSION.get(url, headers=headers, timeout=30, verify=False)
         
         if response.status_code != 200:
             print(f"SunSirs Error: Status Code {response.status_code}")
-            # print(response.text[:200]) # Debug: Print first 200 chars if failed
             return None
 
-        # 2. Parse tables using Pandas (Robust to whitespace/formatting changes)
-        dfs = pd.read_html(response.text)
-        
-        # 3. Iterate through tables to find the one with our product
-        for df in dfs:
-            # Check if any string column contains the product name
-            # SunSirs table usually has columns like: [Product, Sector, Price, Date]
-            # We convert the dataframe to string to search easily
-            mask = df.apply(lambda x: x.astype(str).str.contains("Lithium hexafluorophosphate", case=False, regex=False)).any(axis=1)
-            
-            if mask.any():
-                target_row = df[mask].iloc[0]
-                # Usually Price is in the 3rd column (index 2), but let's look for a number
-                # Convert row to list
-                row_values = target_row.tolist()
-                
-                for val in row_values:
-                    # Look for a value that looks like a price (float > 1000)
-                    try:
-                        price_val = float(str(val).replace(',', '').strip())
-                        if price_val > 1000: # Simple filter to distinguish from small numbers
-                            return {
-                                "name": "六氟磷酸锂 (LiPF6)",
-                                "price": price_val,
-                                "unit": "元/吨",
-                                "source": "SunSirs"
-                            }
-                    except ValueError:
-                        continue
+        body = response.content
+        # 2. Cheap substring gate: skip both parsers if the product isn't on the page at all
+        # bytes.lower() only folds ASCII, so offsets line up with `body`
+        start = body.lower().find(LIPF6_MARKER)
+        if start == -1:
+            print("SunSirs Warning: Product not found on page.")
+            return None
+
+        # 3. Parse the (already decompressed) body and stop at the product row
+        price_val = _parse_lipf6_table(body)
+        if price_val is None:
+            # 4. Regex fallback on the raw bytes (the table layout may have changed)
+            price_val = _parse_lipf6_regex(body, start)
+
+        if price_val is not None:
+            item = {
+                "name": "六氟磷酸锂 (LiPF6)",
+                "price": price_val,
+                "unit": "元/吨",
+                "source": "SunSirs"
+            }
+            # stale_if_error: SunSirs failed and requests_cache served an expired page
+            if getattr(response, "is_expired", False):
+                created_at = response.created_at
+                if created_at.tzinfo is None:
+                    created_at = created_at.replace(tzinfo=timezone.utc)
+                item["stale_hours"] = int((datetime.now(timezone.utc) - created_at).total_seconds() // 3600)
+            return item
         
         print("SunSirs Warning: Product found but could not parse price from table.")
 
-    except Exception as e:
+    except requests.RequestException as e:
+        # Retries are exhausted by the time this is raised
         print(f"Error fetching LiPF6 from SunSirs: {e}")
+    except (ValueError, etree.LxmlError) as e:
+        # Empty or malformed page; report LiPF6 as unavailable instead of aborting the run
+        print(f"Error parsing LiPF6 from SunSirs: {e}")
     
     return None
 
+async def fetch_all():
+    """
+    Fetches every data source concurrently: one batched yfinance download plus the LiPF6 scrape.
+    Symbols yfinance could not deliver fall back to their last-known price.
+    Returns (gold_prices, semi_prices, lipf6).
+    """
+    history, lipf6 = await asyncio.gather(
+        asyncio.to_thread(get_price_history, list(SYMBOLS_GOLD) + list(SYMBOLS_SEMI)),
+        asyncio.to_thread(get_lipf6_price)
+    )
+
+    cache = _load_last_known()
+    gold_data = _with_last_known(cache, "gold", SYMBOLS_GOLD.values(), get_gold_prices(history))
+    semi_data = _with_last_known(
+        cache, "semi", [meta['name'] for meta in SYMBOLS_SEMI.values()], get_semiconductor_prices(history)
+    )
+    _save_last_known(cache)
+
+    return gold_data, semi_data, lipf6
+
+def _stale_tag(info):
+    """
+    Marks entries served from the last-known cache.
+    """
+    if "stale_hours" in info:
+        return f" ⏳ (cached, {info['stale_hours']}h old)"
+    return ""
+
 def send_to_feishu(gold_prices, semi_prices, material_prices):
     """
     Sends the combined price data to Feishu.
     """
     now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    content = f"📊 **Daily Price Monitoring Update**\n🕒 Time: {now}\n\n"
+    parts = [f"📊 **Daily Price Monitoring Update**\n🕒 Time: {now}\n\n"]
     
     # 1. Precious Metals
-    content += "🏆 **Precious Metals**\n"
+    parts.append(HEADER_GOLD)
     if not gold_prices:
-        content += "⚠️ Failed to fetch gold data.\n"
+        parts.append("⚠️ Failed to fetch gold data.\n")
     else:
         for name, info in gold_prices.items():
+            price, unit = info['price'], info['unit']
             trend = "📈" if info['change'] >= 0 else "📉"
-            content += f"🔹 {name}\n"
-            content += f"   Price: `{info['unit']}{info['price']:,.2f}`\n"
-            content += f"   Change: {trend} `{info['change']:+.2f}` (`{info['change_percent']:+.2f}%`)\n"
+            parts.append(f"🔹 {name}{_stale_tag(info)}\n")
+            parts.append(f"   Price: `{unit}{price:,.2f}`\n")
+            parts.append(f"   Change: {trend} `{info['change_str']}` (`{info['change_pct_str']}`)\n")
     
     # 2. Semiconductors
-    content += "\n💾 **Memory & Storage**\n"
+    parts.append(HEADER_SEMI)
     if not semi_prices:
-        content += "⚠️ Failed to fetch semiconductor data.\n"
+        parts.append("⚠️ Failed to fetch semiconductor data.\n")
     else:
         for name, info in semi_prices.items():
             if "error" in info:
-                 content += f"🔸 {name}: `Error` ({info['error']})\n"
+                parts.append(f"🔸 {name}: `Error` ({info['error']})\n")
             else:
+                price, unit = info['price'], info['unit']
                 trend = "📈" if info['change'] >= 0 else "📉"
                 # Formatting: KRW/JPY usually don't use decimals for large numbers
-                content += f"🔸 {name}\n"
-                content += f"   Price: `{info['unit']}{info['price']:,.0f}`\n"
-                content += f"   Change: {trend} `{info['change']:+.0f}` (`{info['change_percent']:+.2f}%`)\n"
+                parts.append(f"🔸 {name}{_stale_tag(info)}\n")
+                parts.append(f"   Price: `{unit}{price:,.0f}`\n")
+                parts.append(f"   Change: {trend} `{info['change_str']}` (`{info['change_pct_str']}`)\n")
 
     # 3. Battery Materials
-    content += "\n🔋 **Battery Materials**\n"
+    parts.append(HEADER_MATERIALS)
     if not material_prices:
-        content += "⚠️ Failed to fetch material data.\n"
+        parts.append("⚠️ Failed to fetch material data.\n")
     else:
         for item in material_prices:
+            name = item['name']
             if "error" in item:
-                content += f"🔹 {item['name']}: `Unavailable` ({item['error']})\n"
+                parts.append(f"🔹 {name}: `Unavailable` ({item['error']})\n")
             else:
-                content += f"🔹 {item['name']}\n"
-                content += f"   Price: `{item['price']:,.2f} {item['unit']}`\n"
-                content += f"   Source: {item['source']}\n"
+                price, unit, source = item['price'], item['unit'], item['source']
+                parts.append(f"🔹 {name}{_stale_tag(item)}\n")
+                parts.append(f"   Price: `{price:,.2f} {unit}`\n")
+                parts.append(f"   Source: {source}\n")
     
-    content += "\n---"
+    parts.append(FOOTER)
+    content = "".join(parts)
 
     payload = {
         "msg_type": "text",
@@ -194,28 +411,28 @@ def send_to_feishu(gold_prices, semi_prices, material_prices):
     }
     
     try:
-        response = requests.post(
+        response = SESSION.post(
             FEISHU_WEBHOOK_URL,
-            data=json.dumps(payload),
-            headers={'Content-Type': 'application/json'}
+            data=orjson.dumps(payload),
+            headers={'Content-Type': 'application/json'},
+            timeout=30
         )
         if response.status_code == 200:
             print("Successfully sent to Feishu.")
         else:
             print(f"Failed to send to Feishu. Status: {response.status_code}")
-    except Exception as e:
+    except requests.RequestException as e:
+        # Retries are exhausted by the time this is raised
         print(f"Error sending to Feishu: {e}")
 
-if __name__ == "__main__":
+async def main():
     print("Starting price fetch...")
-    
-    gold_data = get_gold_prices()
-    semi_data = get_semiconductor_prices()
+
+    gold_data, semi_data, lipf6 = await fetch_all()
     
     material_data = []
     
-    # Fetch LiPF6
-    lipf6 = get_lipf6_price()
+    # LiPF6
     if lipf6:
         material_data.append(lipf6)
     else:
@@ -226,3 +443,6 @@ if __name__ == "__main__":
     material_data.append({"name": "碳酸亚乙烯酯 (VC)", "error": "No Source"})
     
     send_to_feishu(gold_data, semi_data, material_data)
+
+if __name__ == "__main__":
+    asyncio.run(main())
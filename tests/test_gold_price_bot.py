@@ -0,0 +1,226 @@
+import gzip
+import os
+import sys
+import threading
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import orjson
+import pytest
+import requests_cache
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import gold_price_bot  # noqa: E402
+
+PAGE = (
+    b"<html><body><table>"
+    b"<tr><td>Copper</td><td>Metals</td><td>70,000.00</td></tr>"
+    b"<tr><td>Lithium hexafluorophosphate</td><td>Chemical</td><td>65,000.00</td><td>2026-10-14</td></tr>"
+    b"</table></body></html>"
+)
+
+
+class _GzipHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = gzip.compress(self.server.page)
+        self.send_response(self.server.status)
+        self.send_header("Content-Type", "text/html")
+        self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def gzip_server():
+    server = HTTPServer(("127.0.0.1", 0), _GzipHandler)
+    server.page = PAGE
+    server.status = 200
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def fresh_session(monkeypatch, tmp_path):
+    # A fresh cache means the response is stored (and its body consumed) on this request
+    session = requests_cache.CachedSession(
+        str(tmp_path / "price_cache.sqlite"), expire_after=3600, stale_if_error=True
+    )
+    monkeypatch.setattr(gold_price_bot, "SESSION", session)
+    yield session
+    session.close()
+
+
+def test_lipf6_gzip_page_through_fresh_cache(gzip_server, fresh_session):
+    url = f"http://127.0.0.1:{gzip_server.server_port}/prodetail-1432.html"
+
+    result = gold_price_bot.get_lipf6_price(url)
+
+    assert result["price"] == 65000.0
+    assert result["source"] == "SunSirs"
+
+
+@pytest.mark.parametrize("page", [
+    b"",
+    b"<table><tr><td>Lithium hexafluorophosphate</td><td>Chemical</td><td>.</td></tr></table>",
+])
+def test_lipf6_unparseable_page_returns_none(gzip_server, fresh_session, page):
+    gzip_server.page = page
+    url = f"http://127.0.0.1:{gzip_server.server_port}/prodetail-1432.html"
+
+    assert gold_price_bot.get_lipf6_price(url) is None
+
+
+def test_lipf6_stale_cached_page_is_tagged(gzip_server, fresh_session):
+    url = f"http://127.0.0.1:{gzip_server.server_port}/prodetail-1432.html"
+    assert "stale_hours" not in gold_price_bot.get_lipf6_price(url)
+
+    # Age the cached page by 5 hours and let it expire, then take SunSirs down
+    responses = fresh_session.cache.responses
+    key = next(iter(responses.keys()))
+    cached = responses[key]
+    cached.created_at = datetime.now(timezone.utc) - timedelta(hours=5)
+    cached.expires = datetime.now(timezone.utc) - timedelta(hours=4)
+    responses[key] = cached
+    gzip_server.status = 503
+
+    result = gold_price_bot.get_lipf6_price(url)
+
+    assert result["price"] == 65000.0
+    assert result["stale_hours"] == 5
+    assert gold_price_bot._stale_tag(result) == " ⏳ (cached, 5h old)"
+
+
+def test_lipf6_page_without_product_skips_parsing(gzip_server, fresh_session, monkeypatch):
+    gzip_server.page = b"<table>" + b"<tr><td>Copper</td><td>Metals</td><td>70,000.00</td></tr>" * 100 + b"</table>"
+    url = f"http://127.0.0.1:{gzip_server.server_port}/prodetail-1432.html"
+
+    def fail(body):
+        raise AssertionError("table parser should not run")
+
+    monkeypatch.setattr(gold_price_bot, "_parse_lipf6_table", fail)
+    assert gold_price_bot.get_lipf6_price(url) is None
+
+
+def _history(closes):
+    """Builds a yf.download(group_by="ticker")-shaped frame from {symbol: [close, ...]}."""
+    pd = pytest.importorskip("pandas")
+    index = pd.to_datetime(["2026-10-12", "2026-10-13", "2026-10-14"])
+    columns = pd.MultiIndex.from_product([list(closes), ["Close"]])
+    rows = list(zip(*closes.values()))
+    return pd.DataFrame(rows, index=index, columns=columns)
+
+
+NAN = float("nan")
+
+
+def test_prices_from_mixed_calendar_history():
+    history = _history({
+        # COMEX closed on the 13th: NaN row must be skipped, not used as the previous close
+        "GC=F": [2400.0, NAN, 2424.0],
+        "000660.KS": [NAN, 200000.0, 201500.0],
+        "005930.KS": [NAN, NAN, 60000.0],
+    })
+
+    gold = gold_price_bot.get_gold_prices(history)
+    semi = gold_price_bot.get_semiconductor_prices(history)
+
+    comex = gold["Gold Futures (COMEX)"]
+    assert comex["price"] == 2424.0
+    assert comex["change_str"] == "+24.00"
+    assert comex["change_pct_str"] == "+1.00%"
+    # GLD is absent from the frame
+    assert "SPDR Gold Shares (ETF)" not in gold
+
+    assert semi["SK Hynix"]["change_str"] == "+1500"
+    assert semi["SK Hynix"]["change_pct_str"] == "+0.75%"
+    assert semi["Samsung Electronics"]["change_str"] == "+0"
+    assert semi["Kioxia"] == {"error": "No data returned"}
+
+
+def test_last_known_fallback(monkeypatch, tmp_path):
+    monkeypatch.setattr(gold_price_bot, "LAST_KNOWN_PATH", str(tmp_path / "prices.json"))
+    gold_names = list(gold_price_bot.SYMBOLS_GOLD.values())
+    semi_names = [meta["name"] for meta in gold_price_bot.SYMBOLS_SEMI.values()]
+
+    # Run 1: missing file, everything except Kioxia fresh
+    cache = gold_price_bot._load_last_known()
+    assert cache == {}
+    history = _history({
+        "GC=F": [2400.0, 2412.0, 2424.0],
+        "GLD": [220.0, 221.0, 222.0],
+        "000660.KS": [199000.0, 200000.0, 201500.0],
+        "005930.KS": [59000.0, 59500.0, 60000.0],
+    })
+    gold = gold_price_bot._with_last_known(cache, "gold", gold_names, gold_price_bot.get_gold_prices(history))
+    semi = gold_price_bot._with_last_known(
+        cache, "semi", semi_names, gold_price_bot.get_semiconductor_prices(history)
+    )
+    gold_price_bot._save_last_known(cache)
+
+    assert not any("stale_hours" in info for info in gold.values())
+    # Failed with nothing saved: the error entry is kept as-is
+    assert semi["Kioxia"] == {"error": "No data returned"}
+    assert list(gold) == gold_names
+
+    # Run 2, three hours later: GLD and SK Hynix missing from Yahoo's answer
+    cache = gold_price_bot._load_last_known()
+    three_hours_ago = (datetime.now(timezone.utc) - timedelta(hours=3)).isoformat()
+    cache["gold"]["SPDR Gold Shares (ETF)"]["fetched_at"] = three_hours_ago
+    cache["semi"]["SK Hynix"]["fetched_at"] = three_hours_ago
+    history = _history({
+        "GC=F": [2412.0, 2424.0, 2430.0],
+        "005930.KS": [59500.0, 60000.0, 60600.0],
+    })
+    gold = gold_price_bot._with_last_known(cache, "gold", gold_names, gold_price_bot.get_gold_prices(history))
+    semi = gold_price_bot._with_last_known(
+        cache, "semi", semi_names, gold_price_bot.get_semiconductor_prices(history)
+    )
+
+    assert gold["Gold Futures (COMEX)"]["price"] == 2430.0
+    assert "stale_hours" not in gold["Gold Futures (COMEX)"]
+    assert gold["SPDR Gold Shares (ETF)"]["price"] == 222.0
+    assert gold["SPDR Gold Shares (ETF)"]["stale_hours"] == 3
+    assert semi["SK Hynix"]["stale_hours"] == 3
+    assert "fetched_at" not in semi["SK Hynix"]
+    assert semi["Kioxia"] == {"error": "No data returned"}
+
+    sent = {}
+
+    class _Response:
+        status_code = 200
+
+    def fake_post(url, data, headers, **kwargs):
+        sent["text"] = orjson.loads(data)["content"]["text"]
+        return _Response()
+
+    monkeypatch.setattr(gold_price_bot.SESSION, "post", fake_post)
+    gold_price_bot.send_to_feishu(gold, semi, [])
+
+    assert "🔹 SPDR Gold Shares (ETF) ⏳ (cached, 3h old)\n" in sent["text"]
+    assert "🔸 SK Hynix ⏳ (cached, 3h old)\n" in sent["text"]
+    assert "🔹 Gold Futures (COMEX)\n" in sent["text"]
+
+
+def test_load_last_known_ignores_corrupt_file(monkeypatch, tmp_path):
+    path = tmp_path / "prices.json"
+    path.write_bytes(b"{not json")
+    monkeypatch.setattr(gold_price_bot, "LAST_KNOWN_PATH", str(path))
+
+    assert gold_price_bot._load_last_known() == {}
+
+
+def test_webhook_post_only_retried_when_not_delivered():
+    webhook_retry = gold_price_bot.SESSION.get_adapter(gold_price_bot.FEISHU_WEBHOOK_URL).max_retries
+    assert webhook_retry.read == 0
+    assert webhook_retry.other == 0
+    assert set(webhook_retry.status_forcelist) == {429}
+
+    scrape_retry = gold_price_bot.SESSION.get_adapter(gold_price_bot.SUNSIRS_URL).max_retries
+    assert "POST" not in scrape_retry.allowed_methods